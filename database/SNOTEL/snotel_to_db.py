@@ -15,13 +15,11 @@ import numpy as np
 from datetime import timezone
 import datetime as dt
 import sqlite3
-import sqlalchemy as sql
 import zipfile
 from zipfile import ZipFile
-from requests import get as r_get
-from requests.exceptions import ReadTimeout
-from urllib3.exceptions import ReadTimeoutError
+import urllib3
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 
 # Load directories and defaults
 this_dir = Path(__file__).absolute().resolve().parent
@@ -37,13 +35,103 @@ COL_TYPES = {
     'date': str,'site':str,'WTEQ':float,'SNWD':float,'PREC':float,'TAVG':float
 }
 
+# Use the multithreaded pyarrow csv reader when available
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
+# Pooled connections to NWCC (sockets/TLS sessions reused across sites and variables)
+_HTTP = urllib3.PoolManager(
+    num_pools=2,
+    maxsize=16,
+    retries=urllib3.Retry(total=10, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+)
+
 # Define functions
+def _fetch_var(var,name,state,verbose=False):
+    """Download and clean a single SNOTEL variable
+
+    Parameters
+    ---------
+        var: variable for import (e.g., WTEQ)
+        name: site name, with spaces replaced by %20
+        state: two letter state abbreviation
+        verbose: boolean
+            True : enable print during function run
+
+    Returns
+    -------
+        (var, dataframe), dataframe is None if download failed
+
+    """
+    if verbose == True:
+        print("Importing {} data".format(var))
+    site_url = f"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/{var}/{state}/{name}.csv"
+    print(site_url)
+    if verbose == True:
+        print(site_url)
+    try:
+        resp = _HTTP.request('GET', site_url, timeout=urllib3.Timeout(connect=5, read=15))
+    except urllib3.exceptions.HTTPError as error:
+        print(f"{error}")
+        return var, None
+    csv_str = resp.data.decode('utf-8')
+
+    if "not found on this server" in csv_str:
+        print("Site URL incorrect.")
+        return var, None
+
+    csv_io = StringIO(csv_str)
+    f = pd.read_csv(csv_io,index_col=0,engine='c')
+
+    # Keep water year columns only (drops statistics columns)
+    year_cols = [c for c in f.columns if str(c).isdigit()]
+    if not year_cols:
+        print("No water year data found.")
+        return var, None
+
+    # Create index of dates for available data for current site
+    df_index = pd.date_range(pd.to_datetime(f"{f.index[0]}-{int(year_cols[0])-1}",format="%m-%d-%Y",utc=True),
+                               pd.to_datetime(dt.datetime.today(),utc=True),
+                               freq="D")
+
+    # Reshape to one row per day of record, removing missing values
+    # (will no longer include Feb 29 when missing)
+    long = f[year_cols].stack().dropna().reset_index()
+    long.columns = ["mmdd", "year", var]
+
+    # Dates from Oct-Dec fall in the previous calendar year
+    wy = long["year"].astype(int).to_numpy()
+    yrs = np.where(long["mmdd"].str[:2].astype(int).to_numpy() >= 10, wy-1, wy)
+    dates = pd.to_datetime(long["mmdd"].str.cat(yrs.astype(str), sep="-"),
+                           format="%m-%d-%Y", utc=True, cache=True)
+
+    # Create dataframe of available data on the date index (includes Feb 29)
+    snotel_in = pd.Series(long[var].to_numpy(dtype=np.float64), index=dates).reindex(df_index).to_frame(var)
+
+    # For precip, calculate incremental precip and remove negative values
+    if var == "PREC":
+        if verbose == True:
+            print("Calculating incremental Precip.")
+        arr = snotel_in["PREC"].to_numpy()
+        out = np.empty_like(arr)
+        out[0] = np.nan
+        np.subtract(arr[1:], arr[:-1], out=out[1:])
+        np.maximum(out, 0, out=out)
+        snotel_in["PREC"] = out
+
+    # Downcast after all arithmetic is done in float64
+    return var, snotel_in.astype(np.float32)
+
 def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"],out_dir=DEFAULT_CSV_DIR,verbose=False):
     """Download NRCS SNOTEL data
 
     Parameters
     ---------
         site_triplet: three part SNOTEL triplet (e.g., 713_CO_SNTL)
+        snotel_sites: dataframe of SNOTEL sites, indexed by triplet
         vars: array of variables for import (tested with WTEQ, SNWD, PREC, TAVG..other options may be available)
         out_dir: str to directory to save .csv...if None, will return df
         verbose: boolean
@@ -55,105 +143,34 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
 
     """
     # Convert name to string, replacing spaces with %20
-    name = snotel_sites.loc[snotel_sites.triplet==site_triplet,"name"].item().title().replace(" ", "%20")
-    state = snotel_sites.loc[snotel_sites.triplet==site_triplet,"state"].item()
+    name = snotel_sites.at[site_triplet,"name"].title().replace(" ", "%20")
+    state = snotel_sites.at[site_triplet,"state"]
 
-    # Create dictionary of variables
-    snotel_dict = dict()
-    ext = "DAILY"
+    # Download variables concurrently (shares the _HTTP connection pool)
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        results = list(ex.map(lambda v: _fetch_var(v,name,state,verbose), vars))
 
-    # Cycle through variables
-    for var in vars:
-        if verbose == True:
-            print("Importing {} data".format(var))
-        site_url = f"https://nwcc-apps.sc.egov.usda.gov/awdb/site-plots/POR/{var}/{state}/{name}.csv"
-        print(site_url)
-        if verbose == True:
-            print(site_url)
-        failed = True
-        tries = 0
-        csv_str = ""
-        while failed:
-            try:
-                csv_str = r_get(site_url, timeout=5,verify=True).text
-                failed = False
-            except (ConnectionError, TimeoutError,ReadTimeout,ReadTimeoutError) as error:
-                print(f"{error}")
-                tries += 1
-                if tries <= 10:
-                    print(f"After {tries} tries, retrying...")
-                else:
-                    continue
+    # Create dictionary of variables
+    snotel_dict = {var: snotel_in for var, snotel_in in results if snotel_in is not None}
 
-            if "not found on this server" in csv_str:
-                print("Site URL incorrect.")
-                continue
-
-        csv_io = StringIO(csv_str)
-        f = pd.read_csv(csv_io,index_col=0)
-
-        # Create index of dates for available data for current site
-        df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
-                                   dt.datetime.today(),
-                                   freq="D",
-                                   tz='UTC')
-        # Create dataframe of available data (includes Feb 29)
-        snotel_in = pd.DataFrame(index=df_index)
-
-        # Concatenate the cleaned data to the date index
-        for year in f.columns:
-            try:
-                int(year)
-            except ValueError:
-                continue
-            # Remove missing columns...
-            year_data = f.loc[:,year].dropna()
-
-            # Fix index (will no longer include Feb 29 when missing)
-            year_index = list()
-            for i in year_data.index:
-                if int(i[:2])>=10:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)-1}","%m-%d-%Y"))
-                else:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)}", "%m-%d-%Y"))
-
-            year_data.index = pd.DatetimeIndex(year_index,tz="utc")
-
-            # Set appropriate rows in snotel_in
-            snotel_in.loc[year_data.index,var] = year_data
-
-
-        # For precip, calculate incremental precip and remove negative values
-        if var == "PREC":
-            if verbose == True:
-                print("Calculating incremental Precip.")
-            snotel_in["PREC"] = snotel_in[var] - snotel_in[var].shift(1)
-            snotel_in.loc[snotel_in["PREC"] < 0, "PREC"] = 0
-
-        # Add to dict
-        snotel_dict[var] = snotel_in
+    if not snotel_dict:
+        print(f"No data imported for {site_triplet}.")
+        return None
 
     if verbose == True:
         print("Checking dates")
-    begin = end = pd.to_datetime(dt.datetime.now()).tz_localize("UTC")
-    for key in snotel_dict.keys():
-        if snotel_dict[key].index.min() < begin:
-            begin = snotel_dict[key].index.min()
-        if snotel_dict[key].index.max() > end:
-            end = snotel_dict[key].index.max()
+    # Indexes are sorted, so first/last entries are the bounds
+    firsts = [d.index[0] for d in snotel_dict.values()]
+    lasts = [d.index[-1] for d in snotel_dict.values()]
+    begin, end = min(firsts), max(lasts)
 
-    dates = pd.date_range(begin,end,freq="D",tz='UTC')
-    data = pd.DataFrame(index=dates)
-    data["site"] = site_triplet
+    dates = pd.date_range(begin,end,freq="D")
 
     if verbose == True:
         print("Preparing output")
-    for key in snotel_dict.keys():
-        # Merge to output dataframe
-        snotel_in = data.merge(snotel_dict[key][key], left_index=True, right_index=True, how="left")
-        data[key] = snotel_in[key]
-        if verbose == True:
-            print("Added to dataframe")
+    # Align variables side by side on the shared date index
+    data = pd.concat([snotel_dict[key][[key]] for key in snotel_dict], axis=1).reindex(dates)
+    data.insert(0, "site", site_triplet)
 
     if out_dir is None:
         return (data)
@@ -172,38 +189,82 @@ def get_dfs(data_dir=DEFAULT_CSV_DIR,verbose=False):
         if verbose:
             print(f'Adding {data_file.name} to dataframe...')
         df = pd.read_csv(
-            data_file, 
-            usecols=COL_TYPES.keys(),
+            data_file,
+            usecols=list(COL_TYPES),
             parse_dates=['date'],
-            dtype=COL_TYPES
+            dtype={k: v for k, v in COL_TYPES.items() if k != 'date'},
+            engine=CSV_ENGINE
         )
         if not df.empty:
             snotel_df_list.append(
                 df
             )
 
-    df_snotel_dv = pd.concat(snotel_df_list)
+    df_snotel_dv = pd.concat(snotel_df_list, ignore_index=True, copy=False)
     df_snotel_dv.name = 'snotel_dv'
     print('  Success!!!\n')
     return {'snotel_dv':df_snotel_dv}
 
-def get_unique_dates(tbl_name, db_path, date_field=DEFAULT_DATE_FIELD):
+def get_existing_keys(con, date_field=DEFAULT_DATE_FIELD):
     """
-    Get unique dates from snotel data, to ensure no duplicates
+    Get existing (site, date) keys from all snotel tables, to ensure no duplicates
     """
-    if not db_path.is_file():
-        return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    db_con_str = f'sqlite:///{db_path.as_posix()}'
-    eng = sql.create_engine(db_con_str)
-    with eng.connect() as con:
+    existing_keys = set()
+    try:
+        tables = pd.read_sql("select name from sqlite_master where type='table'", con)['name']
+    except Exception:
+        return existing_keys
+    for tbl in tables:
+        if not tbl.startswith('snotel_'):
+            continue
         try:
             unique_dates = pd.read_sql(
-                f'select distinct {date_field} from {tbl_name}',
+                f'select distinct {date_field} from {tbl}',
                 con
             ).dropna()
         except Exception:
-            return pd.DataFrame(columns=[DEFAULT_DATE_FIELD])
-    return pd.to_datetime(unique_dates[date_field])
+            continue
+        site = tbl[len('snotel_'):]
+        dates = pd.to_datetime(unique_dates[date_field], utc=True).astype('int64')
+        existing_keys.update((site, date) for date in dates)
+    return existing_keys
+
+
+def insert_table(con, tbl_name, df, if_exists='replace'):
+    """
+    Bulk insert dataframe rows into a table with executemany
+    """
+    exists = con.execute(
+        "select 1 from sqlite_master where type='table' and name=?", (tbl_name,)
+    ).fetchone() is not None
+    if exists and if_exists == 'fail':
+        raise ValueError(f"Table '{tbl_name}' already exists.")
+    if exists and if_exists == 'replace':
+        con.execute(f'DROP TABLE "{tbl_name}"')
+
+    # Match to_sql storage: datetimes as text, numbers as python types
+    df_out = df.copy()
+    col_defs = []
+    for col in df_out.columns:
+        if pd.api.types.is_datetime64_any_dtype(df_out[col]):
+            df_out[col] = df_out[col].astype(str)
+            col_defs.append(f'"{col}" TIMESTAMP')
+        elif pd.api.types.is_float_dtype(df_out[col]):
+            df_out[col] = df_out[col].astype('float64')
+            col_defs.append(f'"{col}" REAL')
+        elif pd.api.types.is_integer_dtype(df_out[col]):
+            df_out[col] = df_out[col].astype('int64')
+            col_defs.append(f'"{col}" INTEGER')
+        else:
+            col_defs.append(f'"{col}" TEXT')
+    con.execute(f'CREATE TABLE IF NOT EXISTS "{tbl_name}" ({", ".join(col_defs)})')
+
+    cols = ",".join(f'"{col}"' for col in df_out.columns)
+    placeholders = ",".join("?" * len(df_out.columns))
+    con.executemany(
+        f'INSERT INTO "{tbl_name}" ({cols}) VALUES ({placeholders})',
+        df_out.itertuples(index=False, name=None)
+    )
 
 
 def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
@@ -213,50 +274,49 @@ def write_db(df, db_path=DEFAULT_DB_DIR, if_exists='replace', check_dups=False,
     """
     sensor = df.name
     print(f'Creating sqlite db for {df.name}...\n')
-    print('  Getting unique site names...')
-    site_list = pd.unique(df['site'])
     db_name = f"{sensor}.db"
     db_path = Path(db_path, db_name)
     zip_name = f"{sensor}_db.zip"
     zip_path = Path(db_path, zip_name)
     print(f"  Writing {db_path}...")
-    df_site = None
-    con = None
-    for site in site_list:
-        if verbose:
-            print(f'    Getting data for {site}...')
-        df_site = df[df['site'] == site]
-        if df_site.empty:
-            if verbose:
-                print(f'      No data for {site}...')
-            continue
-
-        site_id = site
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('PRAGMA temp_store=MEMORY')
+    con.execute('PRAGMA cache_size=-200000')
+    try:
         if if_exists == 'append' and check_dups:
-            if verbose:
-                print(f'      Checking for duplicate data in {site}...')
-            unique_dates = get_unique_dates(site_id, db_path)
-            initial_len = len(df_site.index)
-            df_site = df_site[~df_site[DEFAULT_DATE_FIELD].isin(unique_dates)]
-            if verbose:
-                print(f'        Prevented {initial_len - len(df_site.index)} duplicates')
-        if verbose:
-            print(f'      Writing snotel_{site_id} to {db_name}...')
-        try:
-            con = sqlite3.connect(db_path)
-            df_site.to_sql(
-                f"snotel_{site_id}",
-                con,
-                if_exists=if_exists,
-                chunksize=10000,
-                method='multi'
-            )
-        except sqlite3.Error as e:
-            print(f'      Error - did not write {site_id} table to {db_name} - {e}')
-        finally:
-            if con:
-                con.close()
-                con = None
+            print('  Checking for duplicate data...')
+            existing_keys = get_existing_keys(con)
+            keys = zip(df['site'], pd.to_datetime(df[DEFAULT_DATE_FIELD], utc=True).astype('int64'))
+            is_new = np.fromiter((key not in existing_keys for key in keys), dtype=bool, count=len(df.index))
+            initial_len = len(df.index)
+            df = df[is_new]
+            print(f'    Prevented {initial_len - len(df.index)} duplicates')
+        with con:
+            for site, df_site in df.groupby('site', sort=False):
+                if verbose:
+                    print(f'    Getting data for {site}...')
+                if df_site.empty:
+                    if verbose:
+                        print(f'      No data for {site}...')
+                    continue
+
+                site_id = site
+                if verbose:
+                    print(f'      Writing snotel_{site_id} to {db_name}...')
+                try:
+                    insert_table(con, f"snotel_{site_id}", df_site, if_exists=if_exists)
+                    con.execute(
+                        f'CREATE INDEX IF NOT EXISTS idx_snotel_{site_id}_date '
+                        f'ON snotel_{site_id} ({DEFAULT_DATE_FIELD})'
+                    )
+                except (sqlite3.Error, ValueError) as e:
+                    print(f'      Error - did not write {site_id} table to {db_name} - {e}')
+    finally:
+        # WAL is only for the build, leave the finished db in rollback mode
+        con.execute('PRAGMA journal_mode=DELETE')
+        con.close()
     if zip_db:
         if verbose:
             print('  When a problem comes along you must zip it! - ({zip_name})')
@@ -322,12 +382,15 @@ if __name__ == '__main__':
     import argparse
 
     # Identify SNOTEL sites:
-    snotel_sites = pd.read_csv(os.path.join(this_dir, "snotel_sites.csv"))
+    snotel_sites = pd.read_csv(os.path.join(this_dir, "snotel_sites.csv")).set_index("triplet", drop=False)
 
-    for site_triplet in snotel_sites.triplet:
+    def _import_site(site_triplet):
         print(site_triplet)
         import_snotel(site_triplet,snotel_sites)
 
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        list(ex.map(_import_site, snotel_sites.triplet))
+
     # Arguments for db build
     args = parse_args()
     print(args)
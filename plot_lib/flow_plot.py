@@ -11,6 +11,7 @@ Script for running the flow plot in the dashboard (shread_dash.py)
 """
 
 import datetime as dt
+import warnings
 import pytz
 import pandas as pd
 import numpy as np
@@ -20,8 +21,18 @@ from database.FLOW.usgs_to_db import import_nwis
 
 from database import csas_gages, usgs_gages
 
+# Gage attribute lookups by site number
+_USGS_NAME = usgs_gages.set_index("site_no")["name"].to_dict()
+_USGS_RFC = usgs_gages.set_index("site_no")["rfc"].to_dict()
+_USGS_COLOR = usgs_gages.set_index("site_no")["color"].to_dict()
+
 from plot_lib.utils import import_csas_live
-from plot_lib.utils import shade_forecast,screen_csas,screen_rfc,screen_usgs
+from plot_lib.utils import shade_forecast,screen_csas,screen_rfc,screen_usgs,ttl_cache
+
+# Cache online fetches between callbacks
+_import_nwis = ttl_cache()(import_nwis)
+_import_rfc = ttl_cache()(import_rfc)
+_import_csas_live = ttl_cache()(import_csas_live)
 
 def get_log_scale_dd(ymax):
     log_scale_dd = [
@@ -72,6 +83,31 @@ def get_log_scale_dd(ymax):
     ]
     return log_scale_dd
 
+# Prebuilt layout for when no sites are selected (default flow max of 50)
+_EMPTY_YMAX = 50 * 1.25
+_EMPTY_FIG = go.Figure(layout=dict(
+    margin={'l': 40, 'b': 40, 't': 0, 'r': 45},
+    height=400,
+    legend={'x': 0, 'y': 1, 'bgcolor': 'rgba(255,255,255,0.8)'},
+    hovermode='closest',
+    plot_bgcolor='white',
+    xaxis=dict(
+        showline=True,
+        linecolor="black",
+        mirror=True
+    ),
+    yaxis=dict(
+        title='Flow (ft^3/s)',
+        side="left",
+        type="log",
+        range=[0.1, np.ceil(np.log10(_EMPTY_YMAX))],
+        showline=True,
+        linecolor="black",
+        mirror=True
+    ),
+    updatemenus=get_log_scale_dd(_EMPTY_YMAX)
+))
+
 def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
                   plot_albedo,offline=True):
     """
@@ -86,6 +122,22 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
     :return: update figure
     """
 
+    # Nothing selected, skip data processing
+    if not usgs_sel and not csas_sel:
+        fig = go.Figure(_EMPTY_FIG)
+        fig.add_trace(shade_forecast(1000000))
+        fig.update_xaxes(range=[start_date, end_date])
+        if plot_albedo == True:
+            fig.update_layout(
+                yaxis2=dict(
+                title="100% - Albedo",
+                side="right",
+                overlaying='y',
+                range=[0,100]),
+                margin = {'l': 40, 'b': 40, 't': 0, 'r': 40},
+            )
+        return fig
+
     # Check if forecast data needed
     if pd.to_datetime(end_date) <= dt.datetime.now():
         forecast_sel = []  # no forecast data needed if dates aren't displayed
@@ -97,22 +149,22 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
         dates = pd.date_range(start_date, end_date, freq="15T", tz='UTC')
 
     # Create dataframes for data, names and rfc sites
-    usgs_f_df = pd.DataFrame(index=dates)
+    usgs_f_df = pd.DataFrame(np.full((len(dates), len(usgs_sel)), np.nan, dtype=np.float64),
+                             index=dates, columns=usgs_sel, copy=False)
     name_df = pd.DataFrame(index=usgs_sel)
 
     if "flow" in forecast_sel:
         rfc_f_df = pd.DataFrame(index=dates)
 
-    for g in usgs_sel:
-        name_df.loc[g, "usgs"] = name_df.loc[g, "name"] = f'{g} {usgs_gages.loc[int(g), "name"]}'
+    for i, g in enumerate(usgs_sel):
+        name_df.loc[g, "usgs"] = name_df.loc[g, "name"] = f'{g} {_USGS_NAME[int(g)]}'
 
         if offline:
             usgs_in = screen_usgs(g,start_date,end_date,dtype)
         else:
-            usgs_in = import_nwis(g,start_date,end_date,dtype)
+            usgs_in = _import_nwis(g,start_date,end_date,dtype)
 
-        usgs_in = usgs_f_df.merge(usgs_in["flow"],left_index=True,right_index=True,how="left")
-        usgs_f_df[g] = usgs_in["flow"]
+        usgs_f_df.iloc[:, i] = usgs_in["flow"].reindex(dates).to_numpy(dtype=np.float64)
 
     if "flow" in forecast_sel:
 
@@ -120,13 +172,13 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
         fcst_dt = "last"
 
         for g in usgs_sel:
-            if pd.isna(usgs_gages.loc[int(g),"rfc"])==False:
-                rfc = usgs_gages.loc[int(g),"rfc"]
+            rfc = _USGS_RFC[int(g)]
+            if pd.isna(rfc)==False:
 
                 if offline:
                     rfc_in,fcst_dt = screen_rfc(rfc,fcst_dt,dtype)
                 else:
-                    rfc_in,fcst_dt = import_rfc(rfc,dtype)
+                    rfc_in,fcst_dt = _import_rfc(rfc,dtype)
 
                 usgs_interp = True
                 if dtype == "dv":
@@ -135,10 +187,18 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
                     if pd.isna(usgs_last):
                         usgs_interp = False
 
-                rfc_in = rfc_f_df.merge(rfc_in["flow"], left_index=True, right_index=True, how="left")
+                rfc_series = rfc_in["flow"].reindex(rfc_f_df.index)
                 if (dtype == "dv") and (usgs_interp):
-                    rfc_in.loc[usgs_last,"flow"] = usgs_f_df.loc[usgs_last,g]
-                rfc_f_df[g] = rfc_in["flow"].interpolate()
+                    rfc_series.loc[usgs_last] = usgs_f_df.loc[usgs_last,g]
+
+                # Linear interpolation of gaps (leading values stay missing)
+                y = rfc_series.to_numpy(dtype=np.float64, copy=True)
+                valid = ~np.isnan(y)
+                if valid.any() and not valid.all():
+                    x = np.arange(y.size)
+                    fill = ~valid & (x > x[valid][0])
+                    y[fill] = np.interp(x[fill], x[valid], y[valid])
+                rfc_f_df[g] = y
 
                 name_df.loc[g,"rfc"] = f"RFC {rfc} {fcst_dt}"
                 name_df.loc[g,"name"] = f'{name_df.loc[g, "usgs"]} ({name_df.loc[g,"rfc"]})'
@@ -146,31 +206,39 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
     if len(usgs_sel) > 0:
         flow_max = usgs_f_df.max().max()
         if ("flow" in forecast_sel) and (len(rfc_f_df)>0):
-            flow_max = np.nanmax([flow_max,rfc_f_df.max().max()])
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                flow_max = np.nanmax([flow_max,rfc_f_df.max().max()])
     else:
         flow_max = 50
 
 
     ## Process CSAS data (if selected)
     if len(csas_sel)>0:
-        csas_f_df = pd.DataFrame()
-        csas_a_df = pd.DataFrame()
+        csas_f = dict()
+        csas_a = dict()
         for site in csas_sel:
             if offline:
                 csas_df = screen_csas(site,start_date,end_date,dtype)
             else:
-                csas_df = import_csas_live(site,start_date,end_date,dtype)
+                csas_df = _import_csas_live(site,start_date,end_date,dtype)
 
             if site == "SBSG":
-                csas_f_df[site] = csas_df["flow"]
+                csas_f[site] = csas_df["flow"]
             elif site != "PTSP":
-                csas_a_df[site] = csas_df["albedo"]
+                csas_a[site] = csas_df["albedo"]
+        csas_f_df = pd.DataFrame(csas_f)
+        csas_a_df = pd.DataFrame(csas_a)
 
-        csas_max = np.nanmax([csas_f_df.max().max(),csas_a_df.max().max()])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            csas_max = np.nanmax([csas_f_df.max().max(),csas_a_df.max().max()])
     else:
         csas_max = np.nan
 
-    ymax = np.nanmax([flow_max,csas_max]) * 1.25
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ymax = np.nanmax([flow_max,csas_max]) * 1.25
 
     print("Updating flow plot...")
 
@@ -181,7 +249,7 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
             y=usgs_f_df[g],
             text=name_df.loc[g, "usgs"],
             mode='lines',
-            line=dict(color=usgs_gages.loc[int(g), "color"]),
+            line=dict(color=_USGS_COLOR[int(g)]),
             name=name_df.loc[g, "name"],
             yaxis="y1"))
         if ("flow" in forecast_sel) and (g in rfc_f_df.columns):
@@ -190,7 +258,7 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
                 y=rfc_f_df[g],
                 text=name_df.loc[g, "rfc"],
                 mode='lines',
-                line=dict(color=usgs_gages.loc[int(g), "color"],dash="dash"),
+                line=dict(color=_USGS_COLOR[int(g)],dash="dash"),
                 name=name_df.loc[g, "rfc"],
                 showlegend=False,
                 yaxis="y1"))
@@ -200,10 +268,10 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
             fig.add_trace(go.Scatter(
                 x=csas_f_df.index,
                 y=csas_f_df[c],
-                text=c+" Flow",
+                text=f"{c} Flow",
                 mode='lines',
                 line=dict(color="green",dash="dot"),
-                name=c+" Flow",
+                name=f"{c} Flow",
                 yaxis="y1"))
         if plot_albedo == True:
             for c in csas_a_df.columns:
@@ -213,7 +281,7 @@ def get_flow_plot(usgs_sel, dtype, forecast_sel, start_date, end_date, csas_sel,
                     text="100% - Albedo",
                     mode='lines',
                     line=dict(color=csas_gages.loc[c, "color"],dash="dash"),
-                    name=c+" 100% - Albedo",
+                    name=f"{c} 100% - Albedo",
                     yaxis="y2"))
 
     fig.add_trace(shade_forecast(1000000))
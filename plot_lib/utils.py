@@ -8,6 +8,7 @@ Additional utilities used in multiple scripts for shread_dash.py
 """
 
 import time
+import functools
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
@@ -27,6 +28,7 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
     Parameters
     ---------
         site_triplet: three part SNOTEL triplet (e.g., 713_CO_SNTL)
+        snotel_sites: dataframe of SNOTEL sites, indexed by triplet
         vars: array of variables for import (tested with WTEQ, SNWD, PREC, TAVG..other options may be available)
         out_dir: str to directory to save .csv...if None, will return df
         verbose: boolean
@@ -38,8 +40,8 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
 
     """
     # Convert name to string, replacing spaces with %20
-    name = snotel_sites.loc[snotel_sites.triplet==site_triplet,"name"].item().title().replace(" ", "%20")
-    state = snotel_sites.loc[snotel_sites.triplet==site_triplet,"state"].item()
+    name = snotel_sites.at[site_triplet,"name"].title().replace(" ", "%20")
+    state = snotel_sites.at[site_triplet,"state"]
 
     # Create dictionary of variables
     snotel_dict = dict()
@@ -76,10 +78,9 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
         f = pd.read_csv(csv_io,index_col=0)
 
         # Create index of dates for available data for current site
-        df_index = pd.date_range(dt.datetime.strptime(f"{f.index[0]}-{int(f.columns[0])-1}","%m-%d-%Y"),
-                                   dt.datetime.today(),
-                                   freq="D",
-                                   tz='UTC')
+        df_index = pd.date_range(pd.to_datetime(f"{f.index[0]}-{int(f.columns[0])-1}",format="%m-%d-%Y",utc=True),
+                                   pd.to_datetime(dt.datetime.today(),utc=True),
+                                   freq="D")
         # Create dataframe of available data (includes Feb 29)
         snotel_in = pd.DataFrame(index=df_index)
 
@@ -93,14 +94,10 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
             year_data = f.loc[:,year].dropna()
 
             # Fix index (will no longer include Feb 29 when missing)
-            year_index = list()
-            for i in year_data.index:
-                if int(i[:2])>=10:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)-1}","%m-%d-%Y"))
-                else:
-                    year_index.append(dt.datetime.strptime(f"{i}-{int(year)}", "%m-%d-%Y"))
-
-            year_data.index = pd.DatetimeIndex(year_index,tz="utc")
+            idx = year_data.index
+            yrs = np.where(idx.str[:2].astype(int) >= 10, int(year)-1, int(year))
+            year_data.index = pd.to_datetime(idx.str.cat(yrs.astype(str), sep="-"),
+                                             format="%m-%d-%Y", utc=True, cache=True)
 
             # Set appropriate rows in snotel_in
             snotel_in.loc[year_data.index,var] = year_data
@@ -118,14 +115,14 @@ def import_snotel(site_triplet,snotel_sites,vars=["WTEQ", "SNWD", "PREC", "TAVG"
 
     if verbose == True:
         print("Checking dates")
-    begin = end = pd.to_datetime(dt.datetime.now()).tz_localize("UTC")
+    begin = end = pd.to_datetime(dt.datetime.now(), utc=True)
     for key in snotel_dict.keys():
         if snotel_dict[key].index.min() < begin:
             begin = snotel_dict[key].index.min()
         if snotel_dict[key].index.max() > end:
             end = snotel_dict[key].index.max()
 
-    dates = pd.date_range(begin,end,freq="D",tz='UTC')
+    dates = pd.date_range(begin,end,freq="D")
     data = pd.DataFrame(index=dates)
     data["site"] = site_triplet
 
@@ -298,7 +295,30 @@ def ba_stats_all(df, date_field="Date"):
     return ba_df
 
 
+# Decorator to cache data fetches between dashboard callbacks
+def ttl_cache(seconds=300, maxsize=256):
+    """
+    Memoize a function on its (hashable) arguments for roughly `seconds`.
+    Cached DataFrames are copied on return so callers can modify them.
+    """
+    def decorator(func):
+        @functools.lru_cache(maxsize=maxsize)
+        def cached(ttl_hash, args, kwargs):
+            return func(*args, **dict(kwargs))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            out = cached(int(time.time() // seconds), args, tuple(sorted(kwargs.items())))
+            if isinstance(out, tuple):
+                return tuple(o.copy() if isinstance(o, pd.DataFrame) else o for o in out)
+            return out.copy() if isinstance(out, pd.DataFrame) else out
+
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
 # Function to screen csas data by site and date
+@ttl_cache()
 def screen_csas(site,s_date,e_date,dtype):
     bind_dict = {
         'iv': 'csas_iv',
@@ -330,6 +350,7 @@ def screen_snotel(site,s_date,e_date):
     out_df.index.name = None
     return (out_df)
 
+@ttl_cache()
 def screen_usgs(site,s_date,e_date,dtype):
     bind = f'usgs_{dtype}'
     qry = (
@@ -343,6 +364,7 @@ def screen_usgs(site,s_date,e_date,dtype):
     out_df.index.name = None
     return (out_df)
 
+@ttl_cache()
 def screen_rfc(site,fcst_dt,dtype):
     bind = f'rfc_{dtype}'
 